@@ -1,17 +1,16 @@
-from flask import Flask
-from threading import Thread
+import os
+import time
+import datetime
 import logging
+import orjson
+from aiohttp import web
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    """Основная страница для проверки работы"""
-    return """
+# Статические ответы кодируются один раз при импорте
+HOME_HTML = ("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -50,45 +49,72 @@ def home():
         </div>
     </body>
     </html>
-    """
+    """).encode('utf-8')
+
+HEALTH_JSON = orjson.dumps({"status": "ok", "service": "dota2-bot"})
+
+async def home(request):
+    """Основная страница для проверки работы"""
+    return web.Response(body=HOME_HTML, content_type='text/html', charset='utf-8')
 
-@app.route('/health')
-def health():
+async def health(request):
     """Эндпоинт для проверки здоровья"""
-    return {"status": "ok", "service": "dota2-bot"}, 200
+    return web.Response(body=HEALTH_JSON, status=200, content_type='application/json')
 
-@app.route('/status')
-def status():
+# Тело /status пересобирается не чаще раза в секунду: [секунда, байты]
+_STATUS_CACHE = [0, b""]
+
+def _status_body():
+    """Готовое тело ответа /status для текущей секунды"""
+    now = int(time.time())
+    if now != _STATUS_CACHE[0]:
+        timestamp = datetime.datetime.fromtimestamp(now).isoformat().encode()
+        _STATUS_CACHE[1] = (
+            b'{"status":"running","timestamp":"' + timestamp +
+            b'","service":"Dota2 Telegram Bot"}'
+        )
+        _STATUS_CACHE[0] = now
+    return _STATUS_CACHE[1]
+
+async def status(request):
     """Статус сервера"""
-    import datetime
-    return {
-        "status": "running",
-        "timestamp": datetime.datetime.now().isoformat(),
-        "service": "Dota2 Telegram Bot"
-    }
+    return web.Response(body=_status_body(), content_type='application/json')
+
+def create_app():
+    """Создание приложения keep-alive сервера"""
+    app = web.Application()
+    app.router.add_get('/', home)
+    app.router.add_get('/health', health)
+    app.router.add_get('/status', status)
+    return app
+
+def get_port():
+    """Порт из переменной окружения или 8080 по умолчанию"""
+    return int(os.environ.get('PORT', 8080))
 
 def run():
-    """Запуск Flask сервера"""
+    """Запуск сервера отдельным процессом"""
     try:
-        # Используем порт из переменной окружения или 8080 по умолчанию
-        port = int(os.environ.get('PORT', 8080))
+        port = get_port()
         logger.info(f"🚀 Запуск keep-alive сервера на порту {port}")
-        app.run(host='0.0.0.0', port=port)
+        web.run_app(create_app(), host='0.0.0.0', port=port)
     except Exception as e:
         logger.error(f"❌ Ошибка запуска сервера: {e}")
 
-def keep_alive():
-    """Запуск сервера в отдельном потоке"""
+async def keep_alive():
+    """Запуск сервера в event loop бота (без отдельного потока)"""
     try:
-        t = Thread(target=run, daemon=True)
-        t.start()
-        logger.info("✅ Keep-alive сервер запущен в фоновом режиме")
-        return t
+        port = get_port()
+        runner = web.AppRunner(create_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host='0.0.0.0', port=port)
+        await site.start()
+        logger.info(f"✅ Keep-alive сервер запущен на порту {port}")
+        return runner
     except Exception as e:
         logger.error(f"❌ Ошибка запуска keep-alive: {e}")
         return None
 
 # Для запуска напрямую
 if __name__ == '__main__':
-    import os
     run()
\ No newline at end of file
@@ -1,5 +1,10 @@
 import os
+import asyncio
 import logging
+import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -7,7 +12,8 @@ logger = logging.getLogger(__name__)
 # Проверяем наличие psycopg2
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    import psycopg2.pool
+    import psycopg2.extensions
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     PSYCOPG2_AVAILABLE = False
@@ -38,68 +44,201 @@ if not DATABASE_URL and PSYCOPG2_AVAILABLE:
     else:
         logger.error("Нет настроек базы данных!")
 
-def get_conn():
-    """Получение соединения с БД"""
+# Серверные prepared statements PostgreSQL: разбор и план запроса
+# выполняются один раз на соединение, дальше только EXECUTE
+PG_STATEMENTS = {
+    'bind_user': """
+        INSERT INTO users (telegram_id, account_id)
+        VALUES ($1, $2)
+        ON CONFLICT (telegram_id)
+        DO UPDATE SET account_id = EXCLUDED.account_id
+    """,
+    'get_account_id': "SELECT account_id FROM users WHERE telegram_id = $1",
+    'add_friend': """
+        INSERT INTO friends (user_id, friend_account_id, friend_name)
+        VALUES ($1, $2, $3)
+    """,
+    'get_friends': """
+        SELECT friend_account_id, friend_name
+        FROM friends
+        WHERE user_id = $1
+        ORDER BY added_at DESC
+    """,
+    'update_score': "UPDATE users SET score = score + $1 WHERE telegram_id = $2",
+    'get_leaderboard': "SELECT telegram_id, score FROM users ORDER BY score DESC LIMIT $1",
+    'get_user': "SELECT telegram_id, score, created_at FROM users WHERE telegram_id = $1",
+    'count_friends': "SELECT COUNT(*) FROM friends WHERE user_id = $1",
+    'get_file_id': "SELECT file_id FROM media_cache WHERE url = $1",
+    'save_file_id': """
+        INSERT INTO media_cache (url, file_id)
+        VALUES ($1, $2)
+        ON CONFLICT (url)
+        DO UPDATE SET file_id = EXCLUDED.file_id
+    """,
+}
+
+if PSYCOPG2_AVAILABLE:
+    class PreparedConnection(psycopg2.extensions.connection):
+        """Соединение PostgreSQL, помнящее, выполнены ли на нем PREPARE"""
+        prepared = False
+
+def _prepare_statements(conn):
+    """Подготовка PG_STATEMENTS на новом соединении пула"""
+    cur = conn.cursor()
+    for name, sql in PG_STATEMENTS.items():
+        cur.execute(f"PREPARE {name} AS {sql}")
+    conn.commit()
+    cur.close()
+    conn.prepared = True
+
+# Пул соединений PostgreSQL / единое соединение SQLite
+POOL = None
+_POOL_LOCK = threading.Lock()
+_SQLITE_CONN = None
+_SQLITE_LOCK = threading.Lock()
+
+def _get_pool():
+    """Ленивое создание пула соединений PostgreSQL"""
+    global POOL
+    
+    if POOL is None:
+        with _POOL_LOCK:
+            if POOL is None:
+                POOL = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=2,
+                    maxconn=20,
+                    dsn=DATABASE_URL,
+                    connection_factory=PreparedConnection
+                )
+    return POOL
+
+def _get_sqlite_conn():
+    """Единое долгоживущее соединение SQLite"""
+    global _SQLITE_CONN
+    
+    if _SQLITE_CONN is None:
+        conn = sqlite3.connect(DATABASE_URL, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Кеш страниц ~20 МБ; скомпилированные запросы sqlite3 кеширует сам
+        conn.execute("PRAGMA cache_size=-20000")
+        _SQLITE_CONN = conn
+    return _SQLITE_CONN
+
+def get_conn(prepare=True):
+    """Получение соединения с БД (вернуть через put_conn)"""
     if USE_SQLITE and SQLITE_AVAILABLE:
-        conn = sqlite3.connect(DATABASE_URL)
-        conn.row_factory = sqlite3.Row  # Для dict-like результатов
-        return conn
+        # Соединение одно на процесс, доступ сериализуем блокировкой
+        _SQLITE_LOCK.acquire()
+        try:
+            return _get_sqlite_conn()
+        except Exception:
+            _SQLITE_LOCK.release()
+            raise
     elif PSYCOPG2_AVAILABLE and DATABASE_URL:
-        return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+        conn = _get_pool().getconn()
+        if prepare and not conn.prepared:
+            try:
+                _prepare_statements(conn)
+            except Exception:
+                POOL.putconn(conn, close=True)
+                raise
+        return conn
     else:
         raise Exception("Нет доступной базы данных")
 
+def put_conn(conn):
+    """Возврат соединения в пул"""
+    if USE_SQLITE and SQLITE_AVAILABLE:
+        _SQLITE_LOCK.release()
+    else:
+        # Откатываем незавершенную транзакцию, битые соединения закрываем
+        if not conn.closed:
+            conn.rollback()
+        POOL.putconn(conn, close=bool(conn.closed))
+
+@contextmanager
+def connection(prepare=True):
+    """Соединение из пула, которое гарантированно возвращается обратно"""
+    conn = get_conn(prepare)
+    try:
+        yield conn
+    finally:
+        put_conn(conn)
+
 def init_db():
     """Инициализация базы данных"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            # SQLite таблицы
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_id BIGINT PRIMARY KEY,
-                    account_id BIGINT NOT NULL,
-                    score INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        # Таблиц еще может не быть, поэтому PREPARE здесь не выполняем
+        with connection(prepare=False) as conn:
+            cur = conn.cursor()
             
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS friends (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id BIGINT,
-                    friend_account_id BIGINT NOT NULL,
-                    friend_name TEXT,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                )
-            """)
-        else:
-            # PostgreSQL таблицы
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_id BIGINT PRIMARY KEY,
-                    account_id BIGINT NOT NULL,
-                    score INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+            if USE_SQLITE:
+                # SQLite таблицы
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        telegram_id BIGINT PRIMARY KEY,
+                        account_id BIGINT NOT NULL,
+                        score INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS friends (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id BIGINT,
+                        friend_account_id BIGINT NOT NULL,
+                        friend_name TEXT,
+                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                    )
+                """)
+                
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS media_cache (
+                        url TEXT PRIMARY KEY,
+                        file_id TEXT NOT NULL
+                    )
+                """)
+            else:
+                # PostgreSQL таблицы
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        telegram_id BIGINT PRIMARY KEY,
+                        account_id BIGINT NOT NULL,
+                        score INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS friends (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT REFERENCES users(telegram_id),
+                        friend_account_id BIGINT NOT NULL,
+                        friend_name TEXT,
+                        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS media_cache (
+                        url TEXT PRIMARY KEY,
+                        file_id TEXT NOT NULL
+                    )
+                """)
             
+            # Индексы: друзья пользователя в порядке добавления и топ по очкам.
+            # Составной индекс покрывает и COUNT по user_id, отдельный не нужен
             cur.execute("""
-                CREATE TABLE IF NOT EXISTS friends (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(telegram_id),
-                    friend_account_id BIGINT NOT NULL,
-                    friend_name TEXT,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+                CREATE INDEX IF NOT EXISTS idx_friends_user_added
+                ON friends(user_id, added_at DESC)
             """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_users_score ON users(score DESC)")
+            
+            conn.commit()
+            cur.close()
         logger.info("✅ База данных инициализирована")
         
     except Exception as e:
@@ -109,25 +248,19 @@ def init_db():
 def bind_user(telegram_id, account_id):
     """Привязка пользователя к аккаунту Steam"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            cur.execute("""
-                INSERT OR REPLACE INTO users (telegram_id, account_id)
-                VALUES (?, ?)
-            """, (telegram_id, account_id))
-        else:
-            cur.execute("""
-                INSERT INTO users (telegram_id, account_id)
-                VALUES (%s, %s)
-                ON CONFLICT (telegram_id) 
-                DO UPDATE SET account_id = EXCLUDED.account_id
-            """, (telegram_id, account_id))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_SQLITE:
+                cur.execute("""
+                    INSERT OR REPLACE INTO users (telegram_id, account_id)
+                    VALUES (?, ?)
+                """, (telegram_id, account_id))
+            else:
+                cur.execute("EXECUTE bind_user (%s, %s)", (telegram_id, account_id))
+            
+            conn.commit()
+            cur.close()
         logger.info(f"Пользователь {telegram_id} привязан к аккаунту {account_id}")
         return True
         
@@ -138,122 +271,236 @@ def bind_user(telegram_id, account_id):
 def get_account_id(telegram_id):
     """Получение account_id пользователя"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            cur.execute("SELECT account_id FROM users WHERE telegram_id = ?", (telegram_id,))
-        else:
-            cur.execute("SELECT account_id FROM users WHERE telegram_id = %s", (telegram_id,))
-        
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-        
-        if row:
-            # Для SQLite row_factory=sqlite3.Row, для psycopg2 RealDictCursor
-            return dict(row)['account_id'] if row else None
-        return None
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_SQLITE:
+                cur.execute("SELECT account_id FROM users WHERE telegram_id = ?", (telegram_id,))
+            else:
+                cur.execute("EXECUTE get_account_id (%s)", (telegram_id,))
+            
+            row = cur.fetchone()
+            cur.close()
+            
+        return row[0] if row else None
         
     except Exception as e:
         logger.error(f"Ошибка получения account_id: {e}")
         return None
 
-def add_friend(telegram_id, friend_account_id, friend_name):
-    """Добавление друга"""
+def get_file_id(url):
+    """Получение file_id Telegram для ранее отправленного фото"""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            cur.execute("""
-                INSERT INTO friends (user_id, friend_account_id, friend_name)
-                VALUES (?, ?, ?)
-            """, (telegram_id, friend_account_id, friend_name))
-        else:
-            cur.execute("""
-                INSERT INTO friends (user_id, friend_account_id, friend_name)
-                VALUES (%s, %s, %s)
-            """, (telegram_id, friend_account_id, friend_name))
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_SQLITE:
+                cur.execute("SELECT file_id FROM media_cache WHERE url = ?", (url,))
+            else:
+                cur.execute("EXECUTE get_file_id (%s)", (url,))
+            
+            row = cur.fetchone()
+            cur.close()
+            
+        return row[0] if row else None
         
-        conn.commit()
-        cur.close()
-        conn.close()
-        logger.info(f"Пользователь {telegram_id} добавил друга {friend_name}")
+    except Exception as e:
+        logger.error(f"Ошибка получения file_id: {e}")
+        return None
+
+def save_file_id(url, file_id):
+    """Сохранение file_id Telegram для фото по его URL"""
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_SQLITE:
+                cur.execute("""
+                    INSERT OR REPLACE INTO media_cache (url, file_id)
+                    VALUES (?, ?)
+                """, (url, file_id))
+            else:
+                cur.execute("EXECUTE save_file_id (%s, %s)", (url, file_id))
+            
+            conn.commit()
+            cur.close()
         return True
         
     except Exception as e:
-        logger.error(f"Ошибка добавления друга: {e}")
+        logger.error(f"Ошибка сохранения file_id: {e}")
+        return False
+
+# Отложенная запись: друзья и очки копятся в буфере и пишутся одной
+# транзакцией раз в FLUSH_INTERVAL или при накоплении FLUSH_BATCH_SIZE
+FLUSH_INTERVAL = 0.1  # секунд
+FLUSH_BATCH_SIZE = 100
+# Если БД недоступна, записи возвращаются в буфер; сверх этого лимита
+# новые записи не принимаются
+FLUSH_MAX_PENDING = FLUSH_BATCH_SIZE * 10
+_PENDING_LOCK = threading.Lock()
+_PENDING_FRIENDS = []  # (telegram_id, friend_account_id, friend_name)
+_PENDING_SCORES = {}   # telegram_id -> суммарное изменение счета
+
+def _queue_write(append):
+    """Добавление записи в буфер; False, если буфер переполнен"""
+    with _PENDING_LOCK:
+        if len(_PENDING_FRIENDS) + len(_PENDING_SCORES) >= FLUSH_MAX_PENDING:
+            return False
+        append()
+        full = len(_PENDING_FRIENDS) + len(_PENDING_SCORES) >= FLUSH_BATCH_SIZE
+    if full:
+        flush_pending()
+    return True
+
+def _requeue(friends, scores):
+    """Возврат несохраненных записей в начало буфера"""
+    with _PENDING_LOCK:
+        _PENDING_FRIENDS[:0] = friends
+        for points, telegram_id in scores:
+            _PENDING_SCORES[telegram_id] = _PENDING_SCORES.get(telegram_id, 0) + points
+
+def _pending_sql():
+    """Запросы вставки друга и изменения счета для текущей БД"""
+    if USE_SQLITE:
+        return (
+            "INSERT INTO friends (user_id, friend_account_id, friend_name) VALUES (?, ?, ?)",
+            "UPDATE users SET score = score + ? WHERE telegram_id = ?"
+        )
+    return "EXECUTE add_friend (%s, %s, %s)", "EXECUTE update_score (%s, %s)"
+
+def _write_pending(friends, scores, row_by_row=False):
+    """Запись одной транзакцией; row_by_row - каждая строка под своим SAVEPOINT.
+    Возвращает отклоненные строки: [(строка, ошибка), ...]"""
+    friend_sql, score_sql = _pending_sql()
+    rejected = []
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            if USE_SQLITE:
+                # Соединение в autocommit, поэтому транзакцию открываем явно
+                cur.execute("BEGIN")
+            
+            if row_by_row:
+                for sql, rows in ((friend_sql, friends), (score_sql, scores)):
+                    for row in rows:
+                        cur.execute("SAVEPOINT pending_row")
+                        try:
+                            cur.execute(sql, row)
+                        except Exception as e:
+                            cur.execute("ROLLBACK TO SAVEPOINT pending_row")
+                            rejected.append((row, e))
+                        cur.execute("RELEASE SAVEPOINT pending_row")
+            else:
+                cur.executemany(friend_sql, friends)
+                cur.executemany(score_sql, scores)
+            
+            if USE_SQLITE:
+                cur.execute("COMMIT")
+            else:
+                conn.commit()
+        except Exception:
+            # PostgreSQL откатывает put_conn, SQLite - здесь
+            if USE_SQLITE and conn.in_transaction:
+                cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+    return rejected
+
+def flush_pending():
+    """Запись накопленных друзей и очков одной транзакцией"""
+    with _PENDING_LOCK:
+        if not _PENDING_FRIENDS and not _PENDING_SCORES:
+            return True
+        friends = _PENDING_FRIENDS[:]
+        scores = [(points, telegram_id) for telegram_id, points in _PENDING_SCORES.items()]
+        _PENDING_FRIENDS.clear()
+        _PENDING_SCORES.clear()
+    
+    try:
+        try:
+            _write_pending(friends, scores)
+        except Exception as e:
+            # Одна ошибочная строка не должна откатывать записи остальных:
+            # повторяем построчно, отбрасываются только сами ошибочные строки
+            logger.warning(f"Пакетная запись не удалась, повтор по строкам: {e}")
+            for row, error in _write_pending(friends, scores, row_by_row=True):
+                logger.error(f"Отложенная запись отклонена {row}: {error}")
+    except Exception as e:
+        # БД недоступна - ничего не теряем, попробуем при следующем сбросе
+        _requeue(friends, scores)
+        logger.error(f"Ошибка записи отложенных изменений ({len(friends)} друзей, {len(scores)} счетов): {e}")
+        return False
+    
+    if scores:
+        _leaderboard_snapshot.cache_clear()
+    return True
+
+async def run_flusher(interval=FLUSH_INTERVAL):
+    """Фоновая задача: периодический сброс буфера, финальный - при остановке"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            if _PENDING_FRIENDS or _PENDING_SCORES:
+                await asyncio.to_thread(flush_pending)
+    finally:
+        flush_pending()
+
+def add_friend(telegram_id, friend_account_id, friend_name):
+    """Добавление друга (запись попадает в БД пачкой через flush_pending)"""
+    # friends.user_id ссылается на users: друга без привязки не записать
+    if get_account_id(telegram_id) is None:
+        logger.error(f"Пользователь {telegram_id} не привязан, друг {friend_name} не добавлен")
+        return False
+    
+    if not _queue_write(lambda: _PENDING_FRIENDS.append((telegram_id, friend_account_id, friend_name))):
+        logger.error(f"Буфер записи переполнен, друг {friend_name} не добавлен")
         return False
+    logger.info(f"Пользователь {telegram_id} добавил друга {friend_name}")
+    return True
 
 def get_friends(telegram_id):
-    """Получение списка друзей"""
+    """Получение списка друзей: [(friend_account_id, friend_name), ...]"""
+    flush_pending()
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            cur.execute("""
-                SELECT friend_account_id, friend_name 
-                FROM friends 
-                WHERE user_id = ?
-                ORDER BY added_at DESC
-            """, (telegram_id,))
-        else:
-            cur.execute("""
-                SELECT friend_account_id, friend_name 
-                FROM friends 
-                WHERE user_id = %s
-                ORDER BY added_at DESC
-            """, (telegram_id,))
-        
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        # Конвертируем в список словарей
-        result = []
-        for row in rows:
-            result.append(dict(row))
-        return result
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            if USE_SQLITE:
+                cur.execute("""
+                    SELECT friend_account_id, friend_name 
+                    FROM friends 
+                    WHERE user_id = ?
+                    ORDER BY added_at DESC
+                """, (telegram_id,))
+            else:
+                cur.execute("EXECUTE get_friends (%s)", (telegram_id,))
+            
+            rows = cur.fetchall()
+            cur.close()
+            
+        # Строки уже кортежи (friend_account_id, friend_name)
+        return rows
         
     except Exception as e:
         logger.error(f"Ошибка получения друзей: {e}")
         return []
 
 def update_score(telegram_id, points):
-    """Обновление счета пользователя"""
-    try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            cur.execute("""
-                UPDATE users 
-                SET score = score + ? 
-                WHERE telegram_id = ?
-            """, (points, telegram_id))
-        else:
-            cur.execute("""
-                UPDATE users 
-                SET score = score + %s 
-                WHERE telegram_id = %s
-            """, (points, telegram_id))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        logger.info(f"Обновлен счет пользователя {telegram_id}: +{points}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Ошибка обновления счета: {e}")
+    """Обновление счета пользователя (изменения одного игрока суммируются)"""
+    def add_points():
+        _PENDING_SCORES[telegram_id] = _PENDING_SCORES.get(telegram_id, 0) + points
+    
+    if not _queue_write(add_points):
+        logger.error(f"Буфер записи переполнен, счет пользователя {telegram_id} не обновлен")
         return False
+    logger.info(f"Обновлен счет пользователя {telegram_id}: +{points}")
+    return True
 
-def get_leaderboard(limit=10):
-    """Получение таблицы лидеров"""
-    try:
-        conn = get_conn()
+@lru_cache(maxsize=16)
+def _leaderboard_snapshot(limit, epoch_minute):
+    """Запрос таблицы лидеров (результат живет в кеше одну минуту)"""
+    with connection() as conn:
         cur = conn.cursor()
         
         if USE_SQLITE:
@@ -264,22 +511,19 @@ def get_leaderboard(limit=10):
                 LIMIT ?
             """, (limit,))
         else:
-            cur.execute("""
-                SELECT telegram_id, score 
-                FROM users 
-                ORDER BY score DESC 
-                LIMIT %s
-            """, (limit,))
+            cur.execute("EXECUTE get_leaderboard (%s)", (limit,))
         
         rows = cur.fetchall()
         cur.close()
-        conn.close()
-        
-        # Конвертируем в список словарей
-        result = []
-        for row in rows:
-            result.append(dict(row))
-        return result
+    
+    # Строки уже кортежи (telegram_id, score)
+    return tuple(rows)
+
+def get_leaderboard(limit=10):
+    """Получение таблицы лидеров: [(telegram_id, score), ...]"""
+    flush_pending()
+    try:
+        return list(_leaderboard_snapshot(limit, int(time.time() // 60)))
         
     except Exception as e:
         logger.error(f"Ошибка получения лидерборда: {e}")
@@ -287,34 +531,41 @@ def get_leaderboard(limit=10):
 
 def get_user_stats(telegram_id):
     """Получение статистики пользователя"""
+    flush_pending()
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        
-        if USE_SQLITE:
-            cur.execute("""
-                SELECT u.telegram_id, u.score, u.created_at,
-                       COUNT(f.id) as friends_count
-                FROM users u
-                LEFT JOIN friends f ON u.telegram_id = f.user_id
-                WHERE u.telegram_id = ?
-                GROUP BY u.telegram_id
-            """, (telegram_id,))
-        else:
-            cur.execute("""
-                SELECT u.telegram_id, u.score, u.created_at,
-                       COUNT(f.id) as friends_count
-                FROM users u
-                LEFT JOIN friends f ON u.telegram_id = f.user_id
-                WHERE u.telegram_id = %s
-                GROUP BY u.telegram_id
-            """, (telegram_id,))
-        
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with connection() as conn:
+            cur = conn.cursor()
+            
+            # Два точечных запроса по индексам вместо JOIN + GROUP BY
+            if USE_SQLITE:
+                cur.execute("""
+                    SELECT telegram_id, score, created_at
+                    FROM users
+                    WHERE telegram_id = ?
+                """, (telegram_id,))
+            else:
+                cur.execute("EXECUTE get_user (%s)", (telegram_id,))
+            
+            row = cur.fetchone()
+            if not row:
+                cur.close()
+                return None
+            
+            if USE_SQLITE:
+                cur.execute("SELECT COUNT(*) FROM friends WHERE user_id = ?", (telegram_id,))
+            else:
+                cur.execute("EXECUTE count_friends (%s)", (telegram_id,))
+            
+            (friends_count,) = cur.fetchone()
+            cur.close()
         
-        return dict(row) if row else None
+        user_id, score, created_at = row
+        return {
+            'telegram_id': user_id,
+            'score': score,
+            'created_at': created_at,
+            'friends_count': friends_count
+        }
         
     except Exception as e:
         logger.error(f"Ошибка получения статистики: {e}")
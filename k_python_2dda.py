@@ -1,12 +1,19 @@
 import os
+import re
 import asyncio
 import aiohttp
+import orjson
 import random
-import json
+import time
+import pickle
 import logging
 from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.enums import ParseMode
+from aiogram.filters import Command, or_f
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -14,7 +21,8 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 import storage
 from keep_alive import keep_alive
-from collections import Counter
+from operator import itemgetter
+from types import MappingProxyType
 
 # Настройка логирования
 logging.basicConfig(
@@ -39,8 +47,16 @@ if not BOT_TOKEN:
 if not STEAM_API_KEY:
     logger.warning("⚠️ STEAM_API_KEY не задан, некоторые функции будут ограничены")
 
+def _orjson_dumps(value) -> str:
+    """orjson для запросов к Telegram (aiogram ожидает str, а не bytes)"""
+    return orjson.dumps(value).decode()
+
 # Инициализация
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(json_loads=orjson.loads, json_dumps=_orjson_dumps),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+)
 storage_obj = MemoryStorage()
 dp = Dispatcher(storage=storage_obj)
 
@@ -51,6 +67,9 @@ try:
 except Exception as e:
     logger.error(f"❌ Ошибка инициализации БД: {e}")
 
+# Общая неизменяемая заглушка для отсутствующих вложенных объектов ответа API
+_EMPTY_DICT = MappingProxyType({})
+
 # Кеши (глобальные переменные)
 HEROES_CACHE = {}
 ITEMS_CACHE = {}
@@ -65,6 +84,15 @@ RANK_TIER_MMR = {
     80: 6000
 }
 
+# Плоская таблица rank_tier -> MMR: индекс вместо хеширования
+RANK_TIER_MMR_ARR = [0] * 90
+for _tier, _mmr in RANK_TIER_MMR.items():
+    RANK_TIER_MMR_ARR[_tier] = _mmr
+
+def rank_tier_to_mmr(tier: int) -> int:
+    """Примерный MMR по rank_tier (0, если ранг неизвестен)"""
+    return RANK_TIER_MMR_ARR[tier] if 0 <= tier < 90 else 0
+
 # Состояния для FSM
 class ProfileStates(StatesGroup):
     waiting_steam_url = State()
@@ -73,11 +101,95 @@ class ProfileStates(StatesGroup):
 class QuizStates(StatesGroup):
     waiting_answer = State()
 
+# === HTTP СЕССИЯ ===
+# Одна сессия на весь процесс: keep-alive соединения и DNS-кеш переиспользуются.
+# Все запросы к OpenDota идут на один хост и делят его пул соединений
+OPENDOTA_API = "https://api.opendota.com/api"
+
+SESSION: aiohttp.ClientSession | None = None
+
+async def get_session() -> aiohttp.ClientSession:
+    """Получение общей HTTP-сессии (создается при первом обращении)"""
+    global SESSION
+    
+    if SESSION is None or SESSION.closed:
+        SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                # С запасом над OPENDOTA_SEMAPHORE: параллельность запросов
+                # к OpenDota ограничивает семафор, а не пул соединений
+                limit_per_host=20,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            ),
+            timeout=aiohttp.ClientTimeout(total=15)
+        )
+    return SESSION
+
+async def close_session():
+    """Закрытие общей HTTP-сессии при остановке бота"""
+    global SESSION
+    
+    if SESSION is not None and not SESSION.closed:
+        await SESSION.close()
+    SESSION = None
+
+# === КЕШ ОТВЕТОВ API ===
+# Ключ (тип запроса, account_id) -> (момент истечения, значение)
+API_CACHE: dict[tuple, tuple[float, object]] = {}
+# Последний успешный ответ без срока жизни - запасной вариант,
+# когда OpenDota недоступен
+STALE_CACHE: dict[tuple, object] = {}
+API_CACHE_MAXSIZE = 2048
+API_CACHE_TTL = 120  # секунд
+PLAYER_CACHE_TTL = 60
+MATCHES_CACHE_TTL = 120
+BENCH_CACHE_TTL = 300
+
+def cache_get(key):
+    """Значение из кеша или None, если его нет или оно устарело"""
+    entry = API_CACHE.get(key)
+    if entry is None:
+        return None
+    
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        API_CACHE.pop(key, None)
+        return None
+    return value
+
+def cache_set(key, value, ttl=API_CACHE_TTL, keep_stale=False):
+    """Сохранение значения в кеш с вытеснением самой старой записи;
+    keep_stale - сохранить и бессрочную копию для cache_get_stale"""
+    API_CACHE.pop(key, None)
+    if len(API_CACHE) >= API_CACHE_MAXSIZE:
+        API_CACHE.pop(next(iter(API_CACHE)))
+    API_CACHE[key] = (time.monotonic() + ttl, value)
+    
+    if keep_stale:
+        STALE_CACHE.pop(key, None)
+        if len(STALE_CACHE) >= API_CACHE_MAXSIZE:
+            STALE_CACHE.pop(next(iter(STALE_CACHE)))
+        STALE_CACHE[key] = value
+
+def cache_get_stale(key):
+    """Последнее сохраненное значение, даже если его срок истек"""
+    return STALE_CACHE.get(key)
+
+def invalidate(account_id: int):
+    """Сброс всех закешированных ответов по игроку"""
+    for kind in ('player', 'matches', 'bench'):
+        API_CACHE.pop((kind, account_id), None)
+
 # === УЛУЧШЕННЫЕ УТИЛИТЫ ===
 def steam64_to_account_id(steam64: int) -> int:
     """Конвертация SteamID64 в Account ID"""
     return steam64 - 76561197960265728
 
+# Ссылки на профиль Steam: числовой SteamID64 или vanity-ник
+_STEAM_PROFILE_RE = re.compile(r"steamcommunity\.com/profiles/(\d+)")
+_STEAM_ID_RE = re.compile(r"steamcommunity\.com/id/([\w-]+)")
+
 async def extract_account_id_safe(steam_url: str) -> int:
     """Безопасное извлечение Account ID из Steam URL"""
     try:
@@ -87,25 +199,25 @@ async def extract_account_id_safe(steam_url: str) -> int:
         if steam_url.isdigit() and len(steam_url) < 11:
             return int(steam_url)
         
-        # Если это profiles/
-        if "/profiles/" in steam_url:
-            steam64 = int(steam_url.split("/")[-1])
-            return steam64_to_account_id(steam64)
+        # Если это profiles/ - SteamID64 прямо в ссылке, без запроса в сеть
+        match = _STEAM_PROFILE_RE.search(steam_url)
+        if match:
+            return steam64_to_account_id(int(match.group(1)))
         
         # Если это id/ (vanity URL)
-        elif "/id/" in steam_url:
-            vanity = steam_url.split("/")[-1]
+        match = _STEAM_ID_RE.search(steam_url)
+        if match:
+            vanity = match.group(1)
             if not STEAM_API_KEY:
                 return None
                 
-            async with aiohttp.ClientSession() as session:
-                url = f"https://api.steampowered.com/ISteamUser/ResolveVanityURL/v1/?key={STEAM_API_KEY}&vanityurl={vanity}"
-                async with session.get(url, timeout=10) as r:
-                    if r.status == 200:
-                        data = await r.json()
-                        if data.get("response", {}).get("success") == 1:
-                            steam64 = int(data["response"]["steamid"])
-                            return steam64_to_account_id(steam64)
+            url = f"https://api.steampowered.com/ISteamUser/ResolveVanityURL/v1/?key={STEAM_API_KEY}&vanityurl={vanity}"
+            async with (await get_session()).get(url, timeout=10) as r:
+                if r.status == 200:
+                    data = orjson.loads(await r.read())
+                    if (data.get("response") or _EMPTY_DICT).get("success") == 1:
+                        steam64 = int(data["response"]["steamid"])
+                        return steam64_to_account_id(steam64)
         
         # Если просто число (возможно steam64 или account_id)
         elif steam_url.isdigit():
@@ -122,138 +234,245 @@ async def extract_account_id_safe(steam_url: str) -> int:
         logger.error(f"Error extracting account id: {e}")
         return None
 
-async def get_player_data(account_id: int):
-    """Получение данных игрока с обработкой ошибок"""
+# === ЗАПРОСЫ К OPENDOTA ===
+# Не больше 8 одновременных запросов (rate limit), до 3 повторов на 429,
+# одинаковые URL в полете объединяются в один запрос
+OPENDOTA_SEMAPHORE = asyncio.Semaphore(8)
+OPENDOTA_MAX_RETRIES = 3
+OPENDOTA_MAX_RETRY_DELAY = 10  # секунд
+INFLIGHT: dict[str, asyncio.Task] = {}
+
+def _retry_delay(retry_after, attempt: int) -> float:
+    """Пауза перед повтором: Retry-After в секундах или экспоненциальная"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.opendota.com/api/players/{account_id}",
-                timeout=10
-            ) as r:
-                if r.status == 200:
-                    return await r.json()
-                logger.warning(f"Player API returned {r.status}")
-                return None
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = 2 ** attempt
+    return min(max(delay, 0), OPENDOTA_MAX_RETRY_DELAY)
+
+async def _get_json(url: str, timeout):
+    """GET с повтором на 429; None при любой ошибке"""
+    try:
+        for attempt in range(OPENDOTA_MAX_RETRIES + 1):
+            async with OPENDOTA_SEMAPHORE:
+                async with (await get_session()).get(url, timeout=timeout) as r:
+                    if r.status == 200:
+                        return orjson.loads(await r.read())
+                    if r.status != 429 or attempt == OPENDOTA_MAX_RETRIES:
+                        logger.warning(f"API {url} returned {r.status}")
+                        return None
+                    delay = _retry_delay(r.headers.get('Retry-After'), attempt)
+            # Ждем вне семафора, чтобы не занимать слот
+            await asyncio.sleep(delay)
     except Exception as e:
-        logger.error(f"Error getting player {account_id}: {e}")
+        logger.error(f"Error requesting {url}: {e}")
         return None
 
+async def fetch_json(url: str, timeout=15):
+    """Запрос к API; параллельные вызовы с тем же URL ждут один ответ"""
+    task = INFLIGHT.get(url)
+    if task is None:
+        # Запрос живет в отдельной задаче: отмена любого из ожидающих,
+        # включая первого, не отменяет его для остальных
+        task = asyncio.ensure_future(_get_json(url, timeout))
+        INFLIGHT[url] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(url, None))
+    return await asyncio.shield(task)
+
+async def get_player_data(account_id: int):
+    """Получение данных игрока с обработкой ошибок"""
+    cached = cache_get(('player', account_id))
+    if cached is not None:
+        return cached
+    
+    data = await fetch_json(f"{OPENDOTA_API}/players/{account_id}", timeout=10)
+    if data is not None:
+        cache_set(('player', account_id), data, PLAYER_CACHE_TTL)
+    return data
+
 async def get_recent_matches(account_id: int, limit=20):
     """Получение последних матчей"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.opendota.com/api/players/{account_id}/recentMatches",
-                timeout=15
-            ) as r:
-                if r.status == 200:
-                    matches = await r.json()
-                    return matches[:limit] if isinstance(matches, list) else []
-                return []
-    except Exception as e:
-        logger.error(f"Error getting matches: {e}")
+    cached = cache_get(('matches', account_id))
+    if cached is not None:
+        return cached[:limit]
+    
+    matches = await fetch_json(f"{OPENDOTA_API}/players/{account_id}/recentMatches")
+    if not isinstance(matches, list):
         return []
+    
+    # Кешируем полный список, лимит применяем при выдаче
+    cache_set(('matches', account_id), matches, MATCHES_CACHE_TTL)
+    return matches[:limit]
 
-async def get_heroes_data():
-    """Получение данных о героях с кешированием"""
-    global HEROES_CACHE
+async def get_benchmarks(account_id: int):
+    """Получение бенчмарков игрока"""
+    cached = cache_get(('bench', account_id))
+    if cached is not None:
+        return cached
     
-    if HEROES_CACHE:
-        return HEROES_CACHE
+    bench = await fetch_json(f"{OPENDOTA_API}/players/{account_id}/benchmarks")
+    if bench is not None:
+        cache_set(('bench', account_id), bench, BENCH_CACHE_TTL, keep_stale=True)
+    return bench
+
+# Параллельность ограничивается внутри fetch_json
+async def get_players_bulk(account_ids: list[int]) -> list[dict]:
+    """Параллельное получение данных нескольких игроков"""
+    return await asyncio.gather(
+        *(get_player_data(aid) for aid in account_ids),
+        return_exceptions=True
+    )
+
+async def get_recent_matches_bulk(account_ids: list[int], limit=20) -> list[list]:
+    """Параллельное получение последних матчей нескольких игроков"""
+    return await asyncio.gather(
+        *(get_recent_matches(aid, limit) for aid in account_ids),
+        return_exceptions=True
+    )
+
+HEROES_JSON = 'hero_names.json'
+HEROES_PICKLE = 'hero_names.pkl'
+
+def _heroes_pickle_is_fresh() -> bool:
+    """Pickle существует и не старше исходного JSON"""
+    try:
+        pickle_mtime = os.path.getmtime(HEROES_PICKLE)
+    except OSError:
+        return False
+    try:
+        return pickle_mtime >= os.path.getmtime(HEROES_JSON)
+    except OSError:
+        return True
+
+def _save_heroes_pickle(heroes: dict):
+    """Сохранение героев с int-ключами для быстрого холодного старта"""
+    try:
+        with open(HEROES_PICKLE, 'wb') as f:
+            pickle.dump(heroes, f, protocol=5)
+    except Exception as e:
+        logger.warning(f"Could not write heroes pickle: {e}")
+
+def _load_heroes_sync() -> dict:
+    """Загрузка героев с диска (до старта event loop, блокирующий open допустим)"""
+    # Быстрый путь: готовый pickle, ключи уже int
+    if _heroes_pickle_is_fresh():
+        try:
+            with open(HEROES_PICKLE, 'rb') as f:
+                heroes = pickle.load(f)
+                logger.info("✅ Герои загружены из pickle")
+                return heroes
+        except Exception as e:
+            logger.warning(f"Heroes pickle unreadable, using JSON: {e}")
     
     try:
-        # Сначала пробуем локальный файл
-        with open('hero_names.json', 'r', encoding='utf-8') as f:
-            HEROES_CACHE = json.load(f)
+        with open(HEROES_JSON, 'rb') as f:
             # Конвертируем строковые ключи в int
-            HEROES_CACHE = {int(k): v for k, v in HEROES_CACHE.items()}
+            heroes = {int(k): v for k, v in orjson.loads(f.read()).items()}
             logger.info("✅ Герои загружены из локального файла")
-            return HEROES_CACHE
+        _save_heroes_pickle(heroes)
+        return heroes
     except Exception as e:
-        logger.warning(f"Local heroes file not found, using API: {e}")
-    
-    # Если локальный файл не найден, используем API
+        logger.warning(f"Local heroes file not found, will use API on startup: {e}")
+        return {}
+
+async def load_heroes_from_api():
+    """Запасной вариант при старте бота: справочник героев из OpenDota"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://api.opendota.com/api/constants/heroes",
-                timeout=15
-            ) as r:
-                if r.status == 200:
-                    data = await r.json()
-                    HEROES_CACHE = {int(k): v['localized_name'] for k, v in data.items()}
-                    return HEROES_CACHE
+        data = await fetch_json(f"{OPENDOTA_API}/constants/heroes")
+        if data:
+            HEROES_CACHE.update({int(k): v['localized_name'] for k, v in data.items()})
     except Exception as e:
         logger.error(f"Error getting heroes: {e}")
-        return {}
 
-async def format_matches_for_display(matches):
+async def ensure_heroes():
+    """Загрузка героев из API, только если их не удалось взять с диска"""
+    if not HEROES_CACHE:
+        await load_heroes_from_api()
+
+HEROES_CACHE.update(_load_heroes_sync())
+
+# Поля матча достаются одним вызовом itemgetter вместо цепочки .get()
+_MATCH_DEFAULTS = {
+    'player_slot': 0, 'radiant_win': False, 'lane_role': 0, 'hero_id': 0,
+    'kills': 0, 'deaths': 0, 'assists': 0, 'duration': 0
+}
+_ANALYTICS_FIELDS = itemgetter('player_slot', 'radiant_win', 'lane_role')
+_DISPLAY_FIELDS = itemgetter('hero_id', 'kills', 'deaths', 'assists', 'duration')
+
+# Роли считаются в массиве фиксированного размера: lane_role -> индекс роли
+_ROLE_NAMES = ("Safe Lane", "Mid Lane", "Off Lane", "Support")
+_LANE_TO_ROLE = (-1, 0, 1, 2, 3, 3)
+
+MATCH_SEPARATOR = "─" * 30
+
+def _match_fields(getter, m):
+    """Поля матча; отсутствующие ключи заменяются значениями по умолчанию"""
+    try:
+        return getter(m)
+    except KeyError:
+        return getter({**_MATCH_DEFAULTS, **m})
+
+def analyze_matches(matches):
+    """Аналитика по матчам за один проход.
+    
+    Возвращает исходы матчей, число побед, счетчики ролей (по индексам
+    _ROLE_NAMES) и индекс основной роли (None, если роли неизвестны).
+    """
+    outcomes = []
+    role_counts = [0, 0, 0, 0]
+    role_order = []  # роли в порядке первого появления - для равных счетов
+    
+    for m in matches:
+        slot, radiant_win, lane = _match_fields(_ANALYTICS_FIELDS, m)
+        
+        # Победа, если сторона игрока совпадает со стороной-победителем
+        outcomes.append((slot < 128) == bool(radiant_win))
+        
+        # Определяем роль (lane_role может прийти как null)
+        if lane and 0 < lane < 6:
+            role = _LANE_TO_ROLE[lane]
+            if not role_counts[role]:
+                role_order.append(role)
+            role_counts[role] += 1
+    
+    main_role = max(role_order, key=role_counts.__getitem__) if role_order else None
+    return outcomes, sum(outcomes), role_counts, main_role
+
+def format_matches_for_display(matches):
     """Форматирование матчей для отображения"""
     if not matches:
         return "📭 Нет данных о последних матчах"
     
-    heroes = await get_heroes_data()
+    heroes = HEROES_CACHE
     lines = []
-    wins = 0
     total = len(matches)
-    roles = []
+    outcomes, wins, role_counts, main_role = analyze_matches(matches)
     
-    for i, m in enumerate(matches[:10], 1):  # Показываем до 10 матчей
-        # Определяем победу
-        is_radiant = m.get('player_slot', 0) < 128
-        radiant_win = m.get('radiant_win', False)
-        win = (is_radiant and radiant_win) or (not is_radiant and not radiant_win)
-        
-        if win: 
-            wins += 1
-        
-        # Определяем роль
-        lane = m.get('lane_role', 0)
-        if lane == 1: 
-            roles.append("Safe Lane")
-        elif lane == 2: 
-            roles.append("Mid Lane")
-        elif lane == 3: 
-            roles.append("Off Lane")
-        elif lane == 4 or lane == 5: 
-            roles.append("Support")
-        
+    # Показываем до 10 матчей
+    for i, (m, win) in enumerate(zip(matches[:10], outcomes), 1):
         # Форматируем детали матча
-        hero_id = m.get('hero_id', 0)
+        hero_id, k, d, a, duration = _match_fields(_DISPLAY_FIELDS, m)
         hero_name = heroes.get(hero_id, f"Герой {hero_id}")
         
-        k, d, a = m.get('kills', 0), m.get('deaths', 0), m.get('assists', 0)
-        
-        # Рассчитываем KDA
-        kda = f"{k}/{d}/{a}"
-        if d > 0:
-            kda_ratio = (k + a) / d
-            kda += f" ({kda_ratio:.2f})"
-        
-        # Время матча
-        duration = m.get('duration', 0)
-        time_str = f"{duration // 60}:{duration % 60:02d}"
+        # KDA с коэффициентом, если были смерти
+        kda_ratio = f" ({(k + a) / d:.2f})" if d > 0 else ""
         
         # Эмодзи для исхода
         outcome = "✅" if win else "❌"
         
-        # Форматируем строку
-        line = f"{i}. {outcome} <b>{hero_name}</b>\n"
-        line += f"   📊 KDA: {kda} | 🕒 {time_str}\n"
-        
-        if i < 6:  # Первые 5 матчей показываем с разделителем
-            lines.append(line + "─" * 30)
-        else:
-            lines.append(line)
+        # Строка матча собирается одним f-string; первые 5 - с разделителем
+        lines.append(
+            f"{i}. {outcome} <b>{hero_name}</b>\n"
+            f"   📊 KDA: {k}/{d}/{a}{kda_ratio} | 🕒 {duration // 60}:{duration % 60:02d}\n"
+            f"{MATCH_SEPARATOR if i < 6 else ''}"
+        )
     
     # Рассчитываем винрейт
     winrate = (wins / total * 100) if total > 0 else 0
     
     # Определяем основную роль
-    if roles:
-        role_counter = Counter(roles)
-        main_role, role_count = role_counter.most_common(1)[0]
-        main_role = f"{main_role} ({role_count}/{len(roles)} игр)"
+    if main_role is not None:
+        main_role = f"{_ROLE_NAMES[main_role]} ({role_counts[main_role]}/{sum(role_counts)} игр)"
     else:
         main_role = "Не определено"
     
@@ -268,7 +487,8 @@ async def format_matches_for_display(matches):
     return header + "\n".join(lines)
 
 # === КЛАВИАТУРЫ ===
-def get_main_keyboard():
+# Клавиатуры статичны: собираются один раз при импорте
+def _build_main_keyboard():
     """Основная клавиатура"""
     builder = ReplyKeyboardBuilder()
     buttons = [
@@ -281,7 +501,7 @@ def get_main_keyboard():
     builder.adjust(2, 2, 2, 2)
     return builder.as_markup(resize_keyboard=True, selective=True)
 
-def get_profile_keyboard():
+def _build_profile_keyboard():
     """Клавиатура для профиля"""
     builder = InlineKeyboardBuilder()
     builder.button(text="🔄 Обновить", callback_data="refresh_profile")
@@ -290,77 +510,245 @@ def get_profile_keyboard():
     builder.adjust(1)
     return builder.as_markup()
 
+def _build_quiz_keyboard():
+    """Клавиатура меню викторины"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🎯 Начать викторину", callback_data="quiz_start")
+    builder.button(text="🏆 Таблица лидеров", callback_data="quiz_leaderboard")
+    builder.button(text="ℹ️ Правила", callback_data="quiz_rules")
+    builder.adjust(1)
+    return builder.as_markup()
+
+MAIN_KB = _build_main_keyboard()
+PROFILE_KB = _build_profile_keyboard()
+QUIZ_KB = _build_quiz_keyboard()
+
+# === ТЕКСТЫ СООБЩЕНИЙ ===
+WELCOME_TEXT = (
+    "🎮 <b>Добро пожаловать в DotaStats Bot!</b>\n\n"
+    "Я помогу вам отслеживать статистику Dota 2:\n\n"
+    "📊 <b>Основные функции:</b>\n"
+    "• 👤 <b>Профиль</b> - ваша статистика и MMR\n"
+    "• 📊 <b>Анализ</b> - сравнение с другими игроками\n"
+    "• 🎮 <b>Викторина</b> - проверьте знания по Dota 2\n"
+    "• 👥 <b>Друзья</b> - сравнение с друзьями\n"
+    "• 🏆 <b>Топ игроков</b> - рейтинг пользователей бота\n\n"
+    "📌 <b>Для начала привяжите Steam профиль:</b>\n"
+    "1. Отправьте ссылку на ваш Steam профиль\n"
+    "2. Или используйте команду /bind\n\n"
+    "⚡ <b>Примеры ссылок:</b>\n"
+    "• https://steamcommunity.com/profiles/76561198...\n"
+    "• https://steamcommunity.com/id/ваш_ник"
+)
+
+HELP_TEXT = (
+    "🆘 <b>Справка по командам:</b>\n\n"
+    "👤 <b>Профиль:</b>\n"
+    "• /profile - ваша статистика\n"
+    "• /bind [ссылка] - привязать Steam профиль\n\n"
+    "📊 <b>Статистика:</b>\n"
+    "• /analyze - анализ производительности\n"
+    "• /compare [ссылка] - сравнение с другим игроком\n\n"
+    "👥 <b>Друзья:</b>\n"
+    "• /addfriend [ссылка] - добавить друга\n"
+    "• /friends - список друзей\n\n"
+    "🎮 <b>Развлечения:</b>\n"
+    "• /quiz - начать викторину\n"
+    "• /leaderboard - таблица лидеров\n\n"
+    "⚙️ <b>Настройки:</b>\n"
+    "• /settings - настройки уведомлений\n"
+    "• /reset - сброс данных\n\n"
+    "📌 <b>Или используйте кнопки меню!</b>"
+)
+
+BIND_PROMPT_TEXT = (
+    "🔗 <b>Отправьте ссылку на ваш Steam профиль:</b>\n\n"
+    "<i>Примеры:</i>\n"
+    "• https://steamcommunity.com/profiles/76561198...\n"
+    "• https://steamcommunity.com/id/your_nickname\n"
+    "• Или просто ваш Steam ID"
+)
+
+QUIZ_MENU_TEXT = (
+    "🎮 <b>Викторина по Dota 2</b>\n\n"
+    "Проверьте свои знания о игре!\n\n"
+    "<b>Правила:</b>\n"
+    "• 10 случайных вопросов\n"
+    "• +10 очков за правильный ответ\n"
+    "• -5 очков за неправильный\n"
+    "• Ограничение по времени: 30 секунд на вопрос"
+)
+
+STALE_NOTICE = "⚠️ <i>Данные устарели: OpenDota сейчас недоступен.</i>\n\n"
+
+ERR_NOT_BOUND = (
+    "❌ <b>Профиль не привязан.</b>\n\n"
+    "Для привязки отправьте ссылку на Steam профиль или используйте команду /bind"
+)
+ERR_BAD_STEAM_URL = (
+    "❌ <b>Не удалось распознать Steam профиль.</b>\n\n"
+    "Проверьте правильность ссылки и попробуйте еще раз."
+)
+ERR_API_PLAYER = (
+    "❌ <b>Не удалось получить данные игрока.</b>\n\n"
+    "Возможно, профиль скрыт или произошла ошибка API."
+)
+ERR_API_PROFILE = (
+    "❌ <b>Не удалось получить данные профиля.</b>\n\n"
+    "Попробуйте позже или обновите привязку."
+)
+ERR_API_ANALYZE = (
+    "❌ <b>Не удалось получить данные для анализа.</b>\n\n"
+    "Попробуйте позже."
+)
+ERR_NO_BENCH = (
+    "❌ <b>Нет данных для анализа.</b>\n\n"
+    "Возможно, у вас недостаточно матчей."
+)
+ERR_BIND = (
+    "❌ <b>Произошла ошибка при обработке профиля.</b>\n\n"
+    "Попробуйте позже или свяжитесь с поддержкой."
+)
+ERR_PROFILE = (
+    "❌ <b>Произошла ошибка при получении профиля.</b>\n\n"
+    "Попробуйте позже."
+)
+ERR_ANALYZE = (
+    "❌ <b>Произошла ошибка при анализе.</b>\n\n"
+    "Попробуйте позже."
+)
+
+# === АНАЛИЗ ПРОИЗВОДИТЕЛЬНОСТИ ===
+# (ключ в ответе /benchmarks, название, средние значения)
+METRICS = (
+    ('gold_per_min', '💰 Золото в минуту (GPM)', 'Среднее: 450-550 GPM'),
+    ('xp_per_min', '📈 Опыт в минуту (XPM)', 'Среднее: 500-600 XPM'),
+    ('kills_per_min', '⚔️ Убийств в минуту', 'Среднее: 0.25-0.35'),
+    ('hero_damage_per_min', '💥 Урон по героям', 'Среднее: 400-500 урона'),
+    ('hero_healing_per_min', '❤️ Лечение в минуту', 'Среднее: 50-100 лечения'),
+    ('tower_damage', '🏰 Урон по башням', 'Среднее: 500-1000 урона'),
+    ('last_hits_per_min', '🎯 Ластхитов в минуту', 'Среднее: 4-6 ластхитов'),
+)
+
+# (нижняя граница перцентиля, эмодзи, оценка) по убыванию границы
+RATING_TABLE = (
+    (0.8, "🔥", "Отлично"),
+    (0.6, "👍", "Хорошо"),
+    (0.4, "➖", "Средне"),
+    (0.2, "⚠️", "Ниже среднего"),
+    (0.0, "❌", "Плохо"),
+)
+
+def rate_percentile(percentile: float) -> tuple[str, str]:
+    """Эмодзи и словесная оценка для перцентиля"""
+    for threshold, emoji, rating in RATING_TABLE:
+        if percentile >= threshold:
+            return emoji, rating
+    return RATING_TABLE[-1][1:]
+
+def _flatten_bench(bench: dict, metrics=METRICS) -> list[tuple[str, str, float, float]]:
+    """Один проход по ответу /benchmarks: (название, средние, перцентиль, значение)"""
+    rows = []
+    append = rows.append
+    for metric_key, metric_name, normal_range in metrics:
+        data_points = bench.get(metric_key)
+        # Убедимся, что есть достаточно данных
+        if not data_points or len(data_points) < 6:
+            continue
+        # Берем пятую точку (обычно 80-й или 90-й перцентиль)
+        point = data_points[4]
+        append((metric_name, normal_range, point.get('percentile', 0), point.get('value', 0)))
+    return rows
+
+# === АВАТАРКИ ===
+# URL аватарки Steam -> file_id уже загруженного в Telegram фото;
+# копия в памяти поверх таблицы media_cache в БД
+AVATAR_FILE_IDS: dict[str, str] = {}
+
+def get_avatar_file_id(url: str):
+    """file_id аватарки из памяти или БД; None, если ее еще не отправляли"""
+    file_id = AVATAR_FILE_IDS.get(url)
+    if file_id is None:
+        file_id = storage.get_file_id(url)
+        if file_id:
+            AVATAR_FILE_IDS[url] = file_id
+    return file_id
+
+async def answer_avatar(message: types.Message, avatar: str, caption: str, reply_markup=None):
+    """Отправка аватарки по file_id, а при первой отправке - по URL"""
+    file_id = get_avatar_file_id(avatar)
+    if file_id:
+        try:
+            return await message.answer_photo(
+                photo=file_id,
+                caption=caption,
+                reply_markup=reply_markup
+            )
+        except TelegramBadRequest as e:
+            # file_id больше не действителен - загружаем заново по URL
+            logger.warning(f"Cached file_id for {avatar} rejected: {e}")
+            AVATAR_FILE_IDS.pop(avatar, None)
+    
+    sent = await message.answer_photo(
+        photo=avatar,
+        caption=caption,
+        reply_markup=reply_markup
+    )
+    if sent.photo:
+        file_id = sent.photo[-1].file_id
+        AVATAR_FILE_IDS[avatar] = file_id
+        storage.save_file_id(avatar, file_id)
+    return sent
+
+# === ФОНОВЫЕ ЗАДАЧИ ===
+# Ссылки на запущенные задачи, чтобы сборщик мусора не снял их до завершения
+BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    """Запуск корутины в фоне без ожидания результата"""
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+async def _send_typing(message: types.Message):
+    """Отправка индикатора "печатает"; ошибка не должна ронять обработчик"""
+    try:
+        await message.answer_chat_action("typing")
+    except Exception as e:
+        logger.warning(f"Failed to send typing action: {e}")
+
+def fire_typing(message: types.Message):
+    """Индикатор "печатает" параллельно с запросами к API"""
+    spawn(_send_typing(message))
+
 # === ОБРАБОТЧИКИ КОМАНД ===
 @dp.message(Command("start"))
 async def start_command(message: types.Message):
     """Обработчик команды /start"""
-    welcome_text = (
-        "🎮 <b>Добро пожаловать в DotaStats Bot!</b>\n\n"
-        "Я помогу вам отслеживать статистику Dota 2:\n\n"
-        "📊 <b>Основные функции:</b>\n"
-        "• 👤 <b>Профиль</b> - ваша статистика и MMR\n"
-        "• 📊 <b>Анализ</b> - сравнение с другими игроками\n"
-        "• 🎮 <b>Викторина</b> - проверьте знания по Dota 2\n"
-        "• 👥 <b>Друзья</b> - сравнение с друзьями\n"
-        "• 🏆 <b>Топ игроков</b> - рейтинг пользователей бота\n\n"
-        "📌 <b>Для начала привяжите Steam профиль:</b>\n"
-        "1. Отправьте ссылку на ваш Steam профиль\n"
-        "2. Или используйте команду /bind\n\n"
-        "⚡ <b>Примеры ссылок:</b>\n"
-        "• https://steamcommunity.com/profiles/76561198...\n"
-        "• https://steamcommunity.com/id/ваш_ник"
-    )
-    
     await message.answer(
-        welcome_text,
-        reply_markup=get_main_keyboard(),
-        parse_mode="HTML"
+        WELCOME_TEXT,
+        reply_markup=MAIN_KB
     )
 
 @dp.message(Command("help"))
 async def help_command(message: types.Message):
     """Обработчик команды /help"""
-    help_text = (
-        "🆘 <b>Справка по командам:</b>\n\n"
-        "👤 <b>Профиль:</b>\n"
-        "• /profile - ваша статистика\n"
-        "• /bind [ссылка] - привязать Steam профиль\n\n"
-        "📊 <b>Статистика:</b>\n"
-        "• /analyze - анализ производительности\n"
-        "• /compare [ссылка] - сравнение с другим игроком\n\n"
-        "👥 <b>Друзья:</b>\n"
-        "• /addfriend [ссылка] - добавить друга\n"
-        "• /friends - список друзей\n\n"
-        "🎮 <b>Развлечения:</b>\n"
-        "• /quiz - начать викторину\n"
-        "• /leaderboard - таблица лидеров\n\n"
-        "⚙️ <b>Настройки:</b>\n"
-        "• /settings - настройки уведомлений\n"
-        "• /reset - сброс данных\n\n"
-        "📌 <b>Или используйте кнопки меню!</b>"
-    )
-    
-    await message.answer(help_text, parse_mode="HTML")
+    await message.answer(HELP_TEXT)
 
 @dp.message(Command("bind"))
 async def bind_command(message: types.Message, state: FSMContext):
     """Привязка Steam профиля"""
-    args = message.text.split()
+    # Аргумент отделяется любым пробельным символом, как и в split()
+    args = message.text.split(None, 1)
+    steam_url = args[1].strip() if len(args) > 1 else ''
     
-    if len(args) > 1:
+    if steam_url:
         # Если ссылка передана сразу в команде
-        steam_url = ' '.join(args[1:])
         await process_steam_url(message, steam_url)
     else:
         # Просим прислать ссылку
-        await message.answer(
-            "🔗 <b>Отправьте ссылку на ваш Steam профиль:</b>\n\n"
-            "<i>Примеры:</i>\n"
-            "• https://steamcommunity.com/profiles/76561198...\n"
-            "• https://steamcommunity.com/id/your_nickname\n"
-            "• Или просто ваш Steam ID",
-            parse_mode="HTML"
-        )
+        await message.answer(BIND_PROMPT_TEXT)
         await state.set_state(ProfileStates.waiting_steam_url)
 
 @dp.message(ProfileStates.waiting_steam_url)
@@ -374,32 +762,32 @@ async def process_steam_url(message: types.Message, steam_url: str):
     """Обработка Steam URL"""
     try:
         # Показываем "типинг"
-        await message.answer_chat_action("typing")
+        fire_typing(message)
         
         # Извлекаем account_id
         account_id = await extract_account_id_safe(steam_url)
         
         if not account_id:
-            await message.answer(
-                "❌ <b>Не удалось распознать Steam профиль.</b>\n\n"
-                "Проверьте правильность ссылки и попробуйте еще раз.",
-                parse_mode="HTML"
-            )
+            await message.answer(ERR_BAD_STEAM_URL)
             return
         
+        # При перепривязке берем свежие данные, а не кеш
+        invalidate(account_id)
+        
+        # Матчи и бенчмарки прогреваем в кеше, не задерживая подтверждение:
+        # первый /profile или /analyze после привязки не пойдет в API
+        spawn(get_recent_matches(account_id))
+        spawn(get_benchmarks(account_id))
+        
         # Получаем данные игрока
         player_data = await get_player_data(account_id)
         
         if not player_data:
-            await message.answer(
-                "❌ <b>Не удалось получить данные игрока.</b>\n\n"
-                "Возможно, профиль скрыт или произошла ошибка API.",
-                parse_mode="HTML"
-            )
+            await message.answer(ERR_API_PLAYER)
             return
         
         # Сохраняем в базу
-        profile_name = player_data.get('profile', {}).get('personaname', 'Игрок')
+        profile_name = (player_data.get('profile') or _EMPTY_DICT).get('personaname', 'Игрок')
         storage.bind_user(message.from_user.id, account_id)
         
         # Отправляем подтверждение
@@ -408,64 +796,56 @@ async def process_steam_url(message: types.Message, steam_url: str):
             f"👤 <b>Игрок:</b> {profile_name}\n"
             f"🆔 <b>Account ID:</b> {account_id}\n\n"
             f"Теперь вы можете использовать все функции бота!",
-            parse_mode="HTML",
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KB
         )
         
         logger.info(f"User {message.from_user.id} bound to account {account_id}")
         
     except Exception as e:
         logger.error(f"Error processing steam URL: {e}")
-        await message.answer(
-            "❌ <b>Произошла ошибка при обработке профиля.</b>\n\n"
-            "Попробуйте позже или свяжитесь с поддержкой.",
-            parse_mode="HTML"
-        )
+        await message.answer(ERR_BIND)
 
-@dp.message(F.text == "👤 Профиль")
-@dp.message(Command("profile"))
-async def profile_command(message: types.Message):
-    """Показ профиля пользователя"""
+async def _render_profile(user_id: int, message: types.Message, *, force: bool = False):
+    """Отправка профиля пользователя user_id в чат сообщения message"""
     try:
         # Получаем account_id из базы
-        account_id = storage.get_account_id(message.from_user.id)
+        account_id = storage.get_account_id(user_id)
         
         if not account_id:
-            await message.answer(
-                "❌ <b>Профиль не привязан.</b>\n\n"
-                "Для привязки отправьте ссылку на Steam профиль или используйте команду /bind",
-                parse_mode="HTML"
-            )
+            await message.answer(ERR_NOT_BOUND)
             return
         
+        # Кнопка "Обновить" - берем данные мимо кеша
+        if force:
+            invalidate(account_id)
+        
         # Показываем "типинг"
-        await message.answer_chat_action("typing")
+        fire_typing(message)
         
-        # Получаем данные игрока
-        player_data = await get_player_data(account_id)
+        # Профиль и матчи - независимые запросы, выполняем их параллельно
+        player_data, matches = await asyncio.gather(
+            get_player_data(account_id),
+            get_recent_matches(account_id, 10)
+        )
         
         if not player_data:
-            await message.answer(
-                "❌ <b>Не удалось получить данные профиля.</b>\n\n"
-                "Попробуйте позже или обновите привязку.",
-                parse_mode="HTML"
-            )
+            await message.answer(ERR_API_PROFILE)
             return
         
         # Извлекаем данные
-        profile = player_data.get('profile', {})
+        profile = player_data.get('profile') or _EMPTY_DICT
         profile_name = profile.get('personaname', 'Неизвестно')
         avatar = profile.get('avatarfull', '')
         
         # Получаем MMR
-        mmr_estimate = player_data.get('mmr_estimate', {}).get('estimate', 0)
+        mmr_estimate = (player_data.get('mmr_estimate') or _EMPTY_DICT).get('estimate', 0)
         rank_tier = player_data.get('rank_tier', 0)
         
         # Форматируем MMR
         if mmr_estimate:
             mmr_text = f"{mmr_estimate} MMR"
         elif rank_tier:
-            mmr_estimate = RANK_TIER_MMR.get(rank_tier, 0)
+            mmr_estimate = rank_tier_to_mmr(rank_tier)
             if mmr_estimate:
                 mmr_text = f"~{mmr_estimate} MMR (ранг {rank_tier})"
             else:
@@ -473,9 +853,7 @@ async def profile_command(message: types.Message):
         else:
             mmr_text = "Неизвестно"
         
-        # Получаем последние матчи
-        matches = await get_recent_matches(account_id, 10)
-        matches_text = await format_matches_for_display(matches)
+        matches_text = format_matches_for_display(matches)
         
         # Формируем сообщение профиля
         profile_text = (
@@ -488,192 +866,154 @@ async def profile_command(message: types.Message):
         
         # Добавляем аватар если есть
         if avatar:
-            await message.answer_photo(
-                photo=avatar,
-                caption=profile_text,
-                parse_mode="HTML",
-                reply_markup=get_profile_keyboard()
-            )
+            await answer_avatar(message, avatar, profile_text, PROFILE_KB)
         else:
             await message.answer(
                 profile_text,
-                parse_mode="HTML",
-                reply_markup=get_profile_keyboard()
+                reply_markup=PROFILE_KB
             )
         
         # Отправляем статистику матчей отдельным сообщением
-        await message.answer(
-            matches_text,
-            parse_mode="HTML"
-        )
+        await message.answer(matches_text)
         
     except Exception as e:
         logger.error(f"Error in profile command: {e}")
-        await message.answer(
-            "❌ <b>Произошла ошибка при получении профиля.</b>\n\n"
-            "Попробуйте позже.",
-            parse_mode="HTML"
-        )
+        await message.answer(ERR_PROFILE)
+
+@dp.message(or_f(F.text == "👤 Профиль", Command("profile")))
+async def profile_command(message: types.Message):
+    """Показ профиля пользователя"""
+    await _render_profile(message.from_user.id, message)
+
+# Повторные нажатия "Обновить" чаще раза в REFRESH_DEBOUNCE секунд игнорируем
+REFRESH_DEBOUNCE = 3
+_last_refresh: dict[int, float] = {}
 
 @dp.callback_query(F.data == "refresh_profile")
 async def refresh_profile_callback(callback: types.CallbackQuery):
     """Обновление профиля"""
+    now = time.monotonic()
+    if now - _last_refresh.get(callback.from_user.id, -REFRESH_DEBOUNCE) < REFRESH_DEBOUNCE:
+        await callback.answer("⏳ Подождите...")
+        return
+    # Истекшие записи больше не нужны: в словаре остаются только нажатия
+    # за последние REFRESH_DEBOUNCE секунд
+    for user_id in [uid for uid, last in _last_refresh.items() if now - last >= REFRESH_DEBOUNCE]:
+        del _last_refresh[user_id]
+    _last_refresh[callback.from_user.id] = now
+    
     await callback.answer("🔄 Обновляем...")
-    await profile_command(callback.message)
+    # callback.message отправлено ботом, поэтому пользователя берем из callback
+    await _render_profile(callback.from_user.id, callback.message, force=True)
 
-@dp.message(F.text == "📊 Анализ")
-@dp.message(Command("analyze"))
+@dp.message(or_f(F.text == "📊 Анализ", Command("analyze")))
 async def analyze_command(message: types.Message):
     """Анализ производительности"""
     try:
         account_id = storage.get_account_id(message.from_user.id)
         
         if not account_id:
-            await message.answer(
-                "❌ <b>Профиль не привязан.</b>\n\n"
-                "Сначала привяжите Steam профиль.",
-                parse_mode="HTML"
-            )
+            await message.answer(ERR_NOT_BOUND)
             return
         
-        await message.answer_chat_action("typing")
+        fire_typing(message)
         
-        # Получаем данные benchmark
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.opendota.com/api/players/{account_id}/benchmarks",
-                timeout=15
-            ) as r:
-                if r.status != 200:
-                    await message.answer(
-                        "❌ <b>Не удалось получить данные для анализа.</b>\n\n"
-                        "Попробуйте позже.",
-                        parse_mode="HTML"
-                    )
-                    return
-                
-                bench = await r.json()
+        # Получаем данные benchmark; если API недоступен - последние сохраненные
+        bench = await get_benchmarks(account_id)
+        stale = False
+        if bench is None:
+            bench = cache_get_stale(('bench', account_id))
+            stale = bench is not None
+        if bench is None:
+            await message.answer(ERR_API_ANALYZE)
+            return
         
         if not bench or 'error' in bench:
-            await message.answer(
-                "❌ <b>Нет данных для анализа.</b>\n\n"
-                "Возможно, у вас недостаточно матчей.",
-                parse_mode="HTML"
-            )
+            await message.answer(ERR_NO_BENCH)
             return
         
         # Формируем анализ
-        analysis_text = "📊 <b>Анализ производительности:</b>\n"
-        analysis_text += "━━━━━━━━━━━━━━━━━━━━\n\n"
-        
-        # Определяем метрики для анализа
-        metrics = {
-            'gold_per_min': ('💰 Золото в минуту (GPM)', 'Среднее: 450-550 GPM'),
-            'xp_per_min': ('📈 Опыт в минуту (XPM)', 'Среднее: 500-600 XPM'),
-            'kills_per_min': ('⚔️ Убийств в минуту', 'Среднее: 0.25-0.35'),
-            'hero_damage_per_min': ('💥 Урон по героям', 'Среднее: 400-500 урона'),
-            'hero_healing_per_min': ('❤️ Лечение в минуту', 'Среднее: 50-100 лечения'),
-            'tower_damage': ('🏰 Урон по башням', 'Среднее: 500-1000 урона'),
-            'last_hits_per_min': ('🎯 Ластхитов в минуту', 'Среднее: 4-6 ластхитов')
-        }
-        
-        for metric_key, (metric_name, normal_range) in metrics.items():
-            if metric_key in bench and bench[metric_key]:
-                # Берем 95-й перцентиль (обычно это показатель игрока)
-                data_points = bench[metric_key]
-                if len(data_points) >= 6:  # Убедимся, что есть достаточно данных
-                    # Берем предпоследний перцентиль (обычно 80-й или 90-й)
-                    target_index = min(4, len(data_points) - 1)
-                    percentile_data = data_points[target_index]
-                    
-                    percentile = percentile_data.get('percentile', 0)
-                    value = percentile_data.get('value', 0)
-                    
-                    # Оценка производительности
-                    if percentile >= 0.8:
-                        emoji = "🔥"
-                        rating = "Отлично"
-                    elif percentile >= 0.6:
-                        emoji = "👍"
-                        rating = "Хорошо"
-                    elif percentile >= 0.4:
-                        emoji = "➖"
-                        rating = "Средне"
-                    elif percentile >= 0.2:
-                        emoji = "⚠️"
-                        rating = "Ниже среднего"
-                    else:
-                        emoji = "❌"
-                        rating = "Плохо"
-                    
-                    analysis_text += (
-                        f"{emoji} <b>{metric_name}</b>\n"
-                        f"   Значение: {value:.1f}\n"
-                        f"   Рейтинг: {rating} (лучше чем {percentile*100:.1f}% игроков)\n"
-                        f"   {normal_range}\n\n"
-                    )
+        parts = [
+            "📊 <b>Анализ производительности:</b>\n",
+            "━━━━━━━━━━━━━━━━━━━━\n\n"
+        ]
+        if stale:
+            parts.insert(0, STALE_NOTICE)
+        metrics_added = 0
+        
+        for metric_name, normal_range, percentile, value in _flatten_bench(bench):
+            # Оценка производительности
+            emoji, rating = rate_percentile(percentile)
+            
+            parts.append(
+                f"{emoji} <b>{metric_name}</b>\n"
+                f"   Значение: {value:.1f}\n"
+                f"   Рейтинг: {rating} (лучше чем {percentile*100:.1f}% игроков)\n"
+                f"   {normal_range}\n\n"
+            )
+            metrics_added += 1
         
         # Добавляем общую оценку
-        if len(analysis_text.split('\n')) > 10:  # Если есть достаточно данных
-            analysis_text += "━━━━━━━━━━━━━━━━━━━━\n"
-            analysis_text += "📈 <b>Совет:</b> Сосредоточьтесь на улучшении показателей с низким рейтингом.\n"
-            analysis_text += "Регулярно анализируйте свои игры для прогресса!"
+        if metrics_added >= 2:  # Если есть достаточно данных
+            parts.append("━━━━━━━━━━━━━━━━━━━━\n")
+            parts.append("📈 <b>Совет:</b> Сосредоточьтесь на улучшении показателей с низким рейтингом.\n")
+            parts.append("Регулярно анализируйте свои игры для прогресса!")
         
-        await message.answer(analysis_text, parse_mode="HTML")
+        await message.answer("".join(parts))
         
     except Exception as e:
         logger.error(f"Error in analyze command: {e}")
-        await message.answer(
-            "❌ <b>Произошла ошибка при анализе.</b>\n\n"
-            "Попробуйте позже.",
-            parse_mode="HTML"
-        )
+        await message.answer(ERR_ANALYZE)
 
-@dp.message(F.text == "🎮 Викторина")
-@dp.message(Command("quiz"))
+@dp.message(or_f(F.text == "🎮 Викторина", Command("quiz")))
 async def quiz_menu_command(message: types.Message):
     """Меню викторины"""
-    keyboard = InlineKeyboardBuilder()
-    keyboard.button(text="🎯 Начать викторину", callback_data="quiz_start")
-    keyboard.button(text="🏆 Таблица лидеров", callback_data="quiz_leaderboard")
-    keyboard.button(text="ℹ️ Правила", callback_data="quiz_rules")
-    keyboard.adjust(1)
-    
     await message.answer(
-        "🎮 <b>Викторина по Dota 2</b>\n\n"
-        "Проверьте свои знания о игре!\n\n"
-        "<b>Правила:</b>\n"
-        "• 10 случайных вопросов\n"
-        "• +10 очков за правильный ответ\n"
-        "• -5 очков за неправильный\n"
-        "• Ограничение по времени: 30 секунд на вопрос",
-        parse_mode="HTML",
-        reply_markup=keyboard.as_markup()
+        QUIZ_MENU_TEXT,
+        reply_markup=QUIZ_KB
     )
 
 # ... (продолжение обработчиков)
 
 async def main():
     """Основная функция запуска бота"""
+    keep_alive_runner = None
+    flusher = None
     try:
         logger.info("🚀 Запуск DotaStats Bot...")
         
-        # Запускаем keep-alive сервер
-        keep_alive()
-        logger.info("✅ Keep-alive сервер запущен")
+        # HTTP-сессию создаем заранее, чтобы первый запрос пользователя
+        # не ждал ее создания
+        await get_session()
         
-        # Загружаем данные героев
-        await get_heroes_data()
+        # Фоновая пакетная запись друзей и очков в БД
+        flusher = asyncio.create_task(storage.run_flusher())
+        
+        # Keep-alive сервер (в том же event loop), герои из API (только если
+        # их нет на диске) и сброс вебхука не зависят друг от друга
+        keep_alive_runner, _, webhook_result = await asyncio.gather(
+            keep_alive(),
+            ensure_heroes(),
+            bot.delete_webhook(drop_pending_updates=True),
+            return_exceptions=True
+        )
+        if isinstance(webhook_result, BaseException):
+            raise webhook_result
         logger.info("✅ Данные героев загружены")
         
         # Запускаем бота
         logger.info("🤖 Бот запущен и готов к работе!")
-        await bot.delete_webhook(drop_pending_updates=True)
         await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске бота: {e}")
     finally:
+        if flusher:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+        if keep_alive_runner:
+            await keep_alive_runner.cleanup()
+        await close_session()
         await bot.session.close()
 
 if __name__ == "__main__":